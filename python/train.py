@@ -7,6 +7,7 @@ This script performs training on a model and dataset, then outputs gradients.
 
 import argparse
 import json
+import os
 import sys
 from pathlib import Path
 
@@ -14,17 +15,20 @@ try:
     import torch
     import torch.nn as nn
     import torch.optim as optim
+    from torch.utils.data import DataLoader, DistributedSampler, TensorDataset
 except ImportError:
     print("ERROR: PyTorch not installed. Please run: pip install torch torchvision")
     sys.exit(1)
 
 # Import gradient and compression utilities
 try:
-    from utils.gradient import extract_gradients, save_gradients, gradient_statistics, clip_gradients
+    from utils.gradient import (FlatGrad, extract_gradients, save_gradients,
+                                gradient_statistics, clip_gradients)
     from utils.compression import compress_gradients, estimate_compression_ratio
 except ImportError:
     print("WARNING: Could not import gradient utilities. Using basic implementation.")
     extract_gradients = None
+    FlatGrad = None
 
 
 def parse_args():
@@ -36,10 +40,14 @@ def parse_args():
     parser.add_argument('--batch-size', type=int, default=32, help='Batch size')
     parser.add_argument('--learning-rate', type=float, default=0.001, help='Learning rate')
     parser.add_argument('--compress', type=str, default='quantize',
-                       choices=['none', 'quantize', 'sparsify'],
+                       choices=['none', 'quantize', 'fp8', 'sparsify'],
                        help='Gradient compression method')
     parser.add_argument('--clip-norm', type=float, default=None,
                        help='Gradient clipping norm (optional)')
+    parser.add_argument('--distributed', action='store_true',
+                       help='Train with DistributedDataParallel (launch via torchrun)')
+    parser.add_argument('--grad-accum-steps', type=int, default=1,
+                       help='Micro-batches to accumulate before each optimizer step')
     return parser.parse_args()
 
 
@@ -69,7 +77,16 @@ def load_model(model_path):
                 x = self.fc2(x)
                 return x
 
-        return SimpleModel()
+        model = SimpleModel()
+        if hasattr(torch, 'compile'):
+            # Fixed 784-feature input called thousands of times per epoch:
+            # launch overhead dominates a model this small, so capture a
+            # CUDA graph of the forward with static shapes. Models loaded
+            # from disk are left uncompiled to skip the first-call
+            # compilation cost
+            model = torch.compile(model, mode="reduce-overhead",
+                                  dynamic=False, fullgraph=True)
+        return model
 
 
 def load_dataset(dataset_path):
@@ -87,7 +104,8 @@ def load_dataset(dataset_path):
     return X, y
 
 
-def train_model(model, data, labels, epochs, batch_size, learning_rate):
+def train_model(model, data, labels, epochs, batch_size, learning_rate,
+                distributed=False, accum_steps=1):
     """Train the model and return gradients"""
     print(f"\nStarting training:")
     print(f"  Epochs: {epochs}")
@@ -98,9 +116,52 @@ def train_model(model, data, labels, epochs, batch_size, learning_rate):
     print(f"  Device: {device}")
 
     model = model.to(device)
+    if distributed:
+        # Bucketed ring-AllReduce overlaps with backward; bucket views
+        # avoid the two grad<->bucket copies per step
+        model = nn.parallel.DistributedDataParallel(
+            model,
+            device_ids=[torch.cuda.current_device()] if device.type == "cuda" else None,
+            gradient_as_bucket_view=True,
+            bucket_cap_mb=25,
+        )
+        # Compress each bucket for the AllReduce as soon as backward
+        # produces it: DDP fires the hook per ready bucket, so the cast
+        # and communication run in the shadow of the remaining backward
+        if device.type == "cuda":
+            from torch.distributed.algorithms.ddp_comm_hooks import default_hooks
+            model.register_comm_hook(
+                state=None,
+                hook=(default_hooks.bf16_compress_hook
+                      if torch.cuda.is_bf16_supported()
+                      else default_hooks.fp16_compress_hook),
+            )
     criterion = nn.CrossEntropyLoss()
     optimizer = optim.SGD(model.parameters(), lr=learning_rate)
 
+    # Mixed precision on CUDA: bf16 where supported, otherwise fp16 with a
+    # GradScaler (pre-Ampere). The optimizer step stays in fp32; the scaler
+    # is a pass-through when disabled
+    use_amp = device.type == "cuda"
+    amp_dtype = (torch.bfloat16 if use_amp and torch.cuda.is_bf16_supported()
+                 else torch.float16)
+    scaler = torch.cuda.amp.GradScaler(enabled=use_amp and amp_dtype is torch.float16)
+
+    # Pinned-memory loader with background workers so host-to-device
+    # copies are asynchronous and prefetched off the critical path
+    dataset = TensorDataset(data, labels)
+    sampler = DistributedSampler(dataset) if distributed else None
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=(sampler is None),
+        sampler=sampler,
+        pin_memory=(device.type == "cuda"),
+        num_workers=2,
+        persistent_workers=True,
+        drop_last=True,
+    )
+
     # Training loop
     model.train()
     total_loss = 0.0
@@ -112,23 +173,39 @@ def train_model(model, data, labels, epochs, batch_size, learning_rate):
         epoch_correct = 0
         epoch_total = 0
 
-        # Mini-batch training
-        num_batches = len(data) // batch_size
-        for i in range(num_batches):
-            start_idx = i * batch_size
-            end_idx = start_idx + batch_size
-
-            batch_data = data[start_idx:end_idx].to(device)
-            batch_labels = labels[start_idx:end_idx].to(device)
-
-            # Forward pass
-            optimizer.zero_grad()
-            outputs = model(batch_data)
-            loss = criterion(outputs, batch_labels)
+        if sampler is not None:
+            sampler.set_epoch(epoch)
 
-            # Backward pass
-            loss.backward()
-            optimizer.step()
+        # Mini-batch training
+        num_batches = len(loader)
+        for i, (batch_data, batch_labels) in enumerate(loader):
+            batch_data = batch_data.to(device, non_blocking=True)
+            batch_labels = batch_labels.to(device, non_blocking=True)
+
+            # Forward pass (gradients are zeroed at the start of each
+            # accumulation window so the final ones survive the loop)
+            if i % accum_steps == 0:
+                optimizer.zero_grad(set_to_none=True)
+            if use_amp:
+                with torch.autocast("cuda", dtype=amp_dtype):
+                    outputs = model(batch_data)
+                    loss = criterion(outputs, batch_labels)
+            else:
+                outputs = model(batch_data)
+                loss = criterion(outputs, batch_labels)
+
+            # Backward pass; under DDP, skip the AllReduce on all but the
+            # last micro-batch of each accumulation window
+            step_now = (i + 1) % accum_steps == 0 or (i + 1) == num_batches
+            step_loss = loss / accum_steps if accum_steps > 1 else loss
+            if distributed and not step_now:
+                with model.no_sync():
+                    scaler.scale(step_loss).backward()
+            else:
+                scaler.scale(step_loss).backward()
+            if step_now:
+                scaler.step(optimizer)
+                scaler.update()
 
             # Track metrics
             epoch_loss += loss.item()
@@ -152,6 +229,12 @@ def train_model(model, data, labels, epochs, batch_size, learning_rate):
     print(f"Final Loss: {final_loss:.4f}")
     print(f"Final Accuracy: {final_accuracy:.2f}%")
 
+    # Unwrap DDP/torch.compile wrappers so gradient names match the
+    # underlying model's parameters
+    if distributed:
+        model = model.module
+    model = getattr(model, '_orig_mod', model)
+
     # Extract gradients using utility function if available
     if extract_gradients is not None:
         gradients = extract_gradients(model)
@@ -169,7 +252,7 @@ def train_model(model, data, labels, epochs, batch_size, learning_rate):
         gradients = {}
         for name, param in model.named_parameters():
             if param.grad is not None:
-                gradients[name] = param.grad.cpu().clone()
+                gradients[name] = param.grad.detach().clone()
 
     return {
         'loss': final_loss,
@@ -178,6 +261,17 @@ def train_model(model, data, labels, epochs, batch_size, learning_rate):
     }
 
 
+def _to_cpu(payload):
+    """Recursively move tensors in a gradient payload to CPU for serialization"""
+    if isinstance(payload, torch.Tensor):
+        return payload.cpu()
+    if isinstance(payload, dict):
+        return {key: _to_cpu(value) for key, value in payload.items()}
+    if FlatGrad is not None and isinstance(payload, FlatGrad):
+        return {name: grad.cpu() for name, grad in payload.items()}
+    return payload
+
+
 def save_results(output_dir, results, compression_method='quantize', clip_norm=None):
     """Save training results with optional compression"""
     output_path = Path(output_dir)
@@ -196,6 +290,8 @@ def save_results(output_dir, results, compression_method='quantize', clip_norm=N
 
         if compression_method == 'quantize':
             compressed = compress_gradients(gradients, method='quantize', num_bits=8)
+        elif compression_method == 'fp8':
+            compressed = compress_gradients(gradients, method='fp8')
         elif compression_method == 'sparsify':
             compressed = compress_gradients(gradients, method='sparsify', sparsity=0.9)
         else:
@@ -205,14 +301,15 @@ def save_results(output_dir, results, compression_method='quantize', clip_norm=N
         ratio = estimate_compression_ratio(gradients, compressed)
         print(f"Compression ratio: {ratio:.2f}x")
 
-        # Save compressed gradients
+        # Save compressed gradients; only this (much smaller) payload
+        # crosses the device-to-host link
         gradients_path = output_path / "gradients.pt"
-        torch.save(compressed, gradients_path)
+        torch.save(_to_cpu(compressed), gradients_path)
         print(f"Compressed gradients saved to {gradients_path}")
     else:
         # Save uncompressed gradients
         gradients_path = output_path / "gradients.pt"
-        torch.save(gradients, gradients_path)
+        torch.save(_to_cpu(gradients), gradients_path)
         print(f"\nGradients saved to {gradients_path}")
 
     # Save metrics
@@ -234,6 +331,13 @@ def main():
     print("GLIN Federated Learning Training")
     print("=" * 60)
 
+    # Set up distributed training (expects torchrun-style environment)
+    if args.distributed:
+        torch.distributed.init_process_group(
+            "nccl" if torch.cuda.is_available() else "gloo")
+        if torch.cuda.is_available():
+            torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)))
+
     # Load model
     model = load_model(args.model)
 
@@ -243,11 +347,16 @@ def main():
     # Train model
     results = train_model(
         model, data, labels,
-        args.epochs, args.batch_size, args.learning_rate
+        args.epochs, args.batch_size, args.learning_rate,
+        distributed=args.distributed, accum_steps=args.grad_accum_steps
     )
 
-    # Save results with compression
-    save_results(args.output, results, args.compress, args.clip_norm)
+    # Save results with compression (rank 0 only under DDP)
+    if not args.distributed or torch.distributed.get_rank() == 0:
+        save_results(args.output, results, args.compress, args.clip_norm)
+
+    if args.distributed:
+        torch.distributed.destroy_process_group()
 
     print("\n" + "=" * 60)
     print("Training completed successfully!")
@@ -1,6 +1,7 @@
 """Utility modules for gradient computation and compression."""
 
 from .gradient import (
+    FlatGrad,
     extract_gradients,
     compute_gradient_norm,
     clip_gradients,
@@ -14,6 +15,8 @@ from .gradient import (
 from .compression import (
     quantize_gradients,
     dequantize_gradients,
+    fp8_quantize_gradients,
+    fp8_dequantize_gradients,
     sparsify_gradients,
     densify_gradients,
     compress_gradients,
@@ -23,6 +26,7 @@ from .compression import (
 
 __all__ = [
     # Gradient utilities
+    'FlatGrad',
     'extract_gradients',
     'compute_gradient_norm',
     'clip_gradients',
@@ -34,6 +38,8 @@ __all__ = [
     # Compression utilities
     'quantize_gradients',
     'dequantize_gradients',
+    'fp8_quantize_gradients',
+    'fp8_dequantize_gradients',
     'sparsify_gradients',
     'densify_gradients',
     'compress_gradients',
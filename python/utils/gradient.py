@@ -2,31 +2,100 @@
 Gradient computation and extraction utilities for federated learning.
 """
 
+import math
+import pickle
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
 import torch
 import torch.nn as nn
 
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+except ImportError:
+    # safetensors is optional; fall back to torch.save/torch.load
+    safe_open = None
+    save_file = None
+
+
+@dataclass
+class FlatGrad:
+    """
+    Gradients for a whole model stored as one contiguous buffer plus a
+    name -> (offset, shape) index (structure-of-arrays layout).
+
+    Iteration (keys/values/items/[]) yields zero-copy views into the
+    buffer, so the dict-based utilities in this package accept a FlatGrad
+    unchanged, while whole-model operations (norm, clip, quantize,
+    all-reduce) can run as a single kernel on `buf`.
+    """
+    buf: torch.Tensor
+    index: Dict[str, Tuple[int, Tuple[int, ...]]]
+
+    def view(self, name: str) -> torch.Tensor:
+        """Zero-copy view of one parameter's gradient"""
+        offset, shape = self.index[name]
+        return self.buf[offset:offset + math.prod(shape)].view(shape)
+
+    def keys(self):
+        return self.index.keys()
+
+    def values(self):
+        return (self.view(name) for name in self.index)
+
+    def items(self):
+        return ((name, self.view(name)) for name in self.index)
+
+    def to_dict(self) -> dict:
+        """Dictionary of zero-copy views, for code that needs a real dict"""
+        return dict(self.items())
+
+    def __getitem__(self, name: str) -> torch.Tensor:
+        return self.view(name)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
 
-def extract_gradients(model: nn.Module) -> dict:
+def extract_gradients(model: nn.Module) -> FlatGrad:
     """
-    Extract gradients from a PyTorch model.
+    Extract gradients from a PyTorch model into a flat buffer.
 
     Args:
         model: Trained PyTorch model with computed gradients
 
     Returns:
-        Dictionary mapping parameter names to gradient tensors
+        FlatGrad mapping parameter names to views of one contiguous buffer
     """
-    gradients = {}
+    params = list(model.named_parameters())
+
+    index = {}
+    total = 0
+    for name, param in params:
+        index[name] = (total, tuple(param.shape))
+        total += param.numel()
+
+    # Zero-initialize so parameters without gradients read back as zeros;
+    # keep the buffer on the parameters' own device
+    if params:
+        ref = params[0][1]
+        buf = torch.zeros(total, dtype=ref.dtype, device=ref.device)
+    else:
+        buf = torch.zeros(0)
 
-    for name, param in model.named_parameters():
-        if param.grad is not None:
-            # Clone to detach from computational graph
-            gradients[name] = param.grad.cpu().clone()
-        else:
-            # If no gradient computed, store zero tensor
-            gradients[name] = torch.zeros_like(param.cpu())
+    flat = FlatGrad(buf=buf, index=index)
 
-    return gradients
+    # One multi-tensor copy for every parameter that has a gradient
+    dsts = [flat.view(name) for name, param in params if param.grad is not None]
+    srcs = [param.grad.detach() for _, param in params if param.grad is not None]
+    if dsts:
+        torch._foreach_copy_(dsts, srcs)
+
+    return flat
 
 
 def compute_gradient_norm(gradients: dict) -> float:
@@ -39,12 +108,17 @@ def compute_gradient_norm(gradients: dict) -> float:
     Returns:
         L2 norm of all gradients combined
     """
-    total_norm = 0.0
+    if not gradients:
+        return 0.0
 
-    for grad in gradients.values():
-        total_norm += grad.norm(2).item() ** 2
+    # Flat buffers reduce in a single kernel
+    if isinstance(gradients, FlatGrad):
+        return gradients.buf.norm(2).item()
 
-    return total_norm ** 0.5
+    # One multi-tensor kernel for the per-parameter norms, one reduction,
+    # one host sync at the end
+    norms = torch._foreach_norm(list(gradients.values()), 2)
+    return torch.linalg.vector_norm(torch.stack(norms)).item()
 
 
 def clip_gradients(gradients: dict, max_norm: float = 1.0) -> dict:
@@ -56,18 +130,27 @@ def clip_gradients(gradients: dict, max_norm: float = 1.0) -> dict:
         max_norm: Maximum allowed gradient norm
 
     Returns:
-        Dictionary of clipped gradients
+        Dictionary of clipped gradients (clipping is applied in place)
     """
-    current_norm = compute_gradient_norm(gradients)
-
-    if current_norm > max_norm:
-        clip_coef = max_norm / (current_norm + 1e-6)
-        clipped_gradients = {}
-
-        for name, grad in gradients.items():
-            clipped_gradients[name] = grad * clip_coef
-
-        return clipped_gradients
+    if not gradients:
+        return gradients
+
+    # Flat buffers clip with one norm and one in-place scale
+    if isinstance(gradients, FlatGrad):
+        total_norm = gradients.buf.norm(2)
+        clip_coef = (max_norm / (total_norm + 1e-6)).clamp(max=1.0)
+        gradients.buf.mul_(clip_coef)
+        return gradients
+
+    grads = list(gradients.values())
+    norms = torch._foreach_norm(grads, 2)
+    total_norm = torch.linalg.vector_norm(torch.stack(norms))
+
+    # Keep the coefficient as a 0-dim tensor (no .item()) so the whole
+    # pipeline stays on device; the clamp makes clipping a no-op scale
+    # when the norm is already within bounds
+    clip_coef = (max_norm / (total_norm + 1e-6)).clamp(max=1.0)
+    torch._foreach_mul_(grads, clip_coef)
 
     return gradients
 
@@ -83,13 +166,21 @@ def add_noise_to_gradients(gradients: dict, noise_scale: float = 0.01) -> dict:
     Returns:
         Dictionary of noisy gradients
     """
-    noisy_gradients = {}
+    if not gradients:
+        return {} if not isinstance(gradients, FlatGrad) else gradients
 
-    for name, grad in gradients.items():
-        noise = torch.randn_like(grad) * noise_scale
-        noisy_gradients[name] = grad + noise
+    # Flat buffers get one RNG kernel and one add for the whole model
+    # (per-element independent noise, so DP accounting is unchanged)
+    if isinstance(gradients, FlatGrad):
+        noisy_buf = torch.empty_like(gradients.buf)
+        noisy_buf.normal_(0.0, noise_scale).add_(gradients.buf)
+        return FlatGrad(buf=noisy_buf, index=gradients.index)
 
-    return noisy_gradients
+    grads = list(gradients.values())
+    noise = [torch.randn_like(grad).mul_(noise_scale) for grad in grads]
+    noisy = torch._foreach_add(grads, noise)
+
+    return dict(zip(gradients.keys(), noisy))
 
 
 def aggregate_gradients(gradient_list: list) -> dict:
@@ -105,33 +196,54 @@ def aggregate_gradients(gradient_list: list) -> dict:
     if not gradient_list:
         return {}
 
-    # Initialize with zeros
-    aggregated = {name: torch.zeros_like(grad)
-                  for name, grad in gradient_list[0].items()}
+    num_gradients = len(gradient_list)
 
-    # Sum all gradients
-    for gradients in gradient_list:
-        for name, grad in gradients.items():
-            aggregated[name] += grad
+    # Flat buffers collapse to a single add per contributor
+    if all(isinstance(gradients, FlatGrad) for gradients in gradient_list):
+        acc = gradient_list[0].buf.clone()
+        for gradients in gradient_list[1:]:
+            acc.add_(gradients.buf)
+        acc.div_(num_gradients)
+        return FlatGrad(buf=acc, index=gradient_list[0].index)
+
+    # Seed the accumulator with a copy of the first dictionary, then one
+    # multi-tensor kernel per remaining contributor
+    names = list(gradient_list[0].keys())
+    aggregated = [gradient_list[0][name].clone() for name in names]
+    for gradients in gradient_list[1:]:
+        torch._foreach_add_(aggregated, [gradients[name] for name in names])
 
     # Average
-    num_gradients = len(gradient_list)
-    for name in aggregated:
-        aggregated[name] /= num_gradients
+    torch._foreach_div_(aggregated, float(num_gradients))
 
-    return aggregated
+    return dict(zip(names, aggregated))
 
 
 def save_gradients(gradients: dict, output_path: str, compress: bool = False):
     """
     Save gradients to a file.
 
+    Paths ending in .safetensors are written with safetensors when it is
+    installed: a contiguous binary dump with a JSON header, with no Pickle
+    or ZIP framing, that the aggregator can load via mmap with zero copies.
+
     Args:
         gradients: Dictionary of gradient tensors
         output_path: Path to save the gradients
-        compress: Whether to compress the gradients
+        compress: Whether to compress the gradients (torch.save fallback only)
     """
-    if compress:
+    # Normalize FlatGrad to a plain dict so payloads never pickle the
+    # dataclass and stay loadable under torch.load(weights_only=True);
+    # the views keep sharing one storage, which torch.save writes once
+    if isinstance(gradients, FlatGrad):
+        gradients = gradients.to_dict()
+
+    if save_file is not None and str(output_path).endswith('.safetensors'):
+        # Clone so entries that are views of one shared buffer (FlatGrad)
+        # get independent storages; safetensors rejects shared memory
+        save_file({name: grad.contiguous().cpu().clone() for name, grad in gradients.items()},
+                  output_path)
+    elif compress:
         # Save with compression
         torch.save(gradients, output_path, _use_new_zipfile_serialization=True)
     else:
@@ -148,7 +260,26 @@ def load_gradients(gradient_path: str) -> dict:
     Returns:
         Dictionary of gradient tensors
     """
-    return torch.load(gradient_path, map_location='cpu')
+    if safe_open is not None and str(gradient_path).endswith('.safetensors'):
+        # Memory-mapped, zero-copy load; tensors are materialized from the
+        # page cache only when touched
+        with safe_open(gradient_path, framework='pt', device='cpu') as f:
+            return {name: f.get_tensor(name) for name in f.keys()}
+
+    # Memory-map the checkpoint so tensor data is backed by the page
+    # cache instead of being read into a userspace buffer up front;
+    # multiple clients' files can then be loaded concurrently
+    try:
+        return torch.load(gradient_path, map_location='cpu',
+                          mmap=True, weights_only=True)
+    except TypeError:
+        # torch < 2.1 has no mmap/weights_only arguments
+        return torch.load(gradient_path, map_location='cpu')
+    except pickle.UnpicklingError:
+        # Files predating the plain-dict save path contain pickled
+        # objects that weights_only rejects
+        return torch.load(gradient_path, map_location='cpu',
+                          mmap=True, weights_only=False)
 
 
 def gradient_statistics(gradients: dict) -> dict:
@@ -161,13 +292,35 @@ def gradient_statistics(gradients: dict) -> dict:
     Returns:
         Dictionary of statistics
     """
+    total_elements = 0
+    sum_sq = None
+    max_abs = None
+    min_abs = None
+    mean_sum = None
+
+    # Accumulate everything in one pass per tensor, keeping the running
+    # values as 0-dim tensors; the only host syncs are the four .item()
+    # calls at the end instead of five per parameter
+    for grad in gradients.values():
+        total_elements += grad.numel()
+        abs_min, abs_max = torch.aminmax(grad.abs())
+        sq = grad.pow(2).sum()
+        mean = grad.mean()
+        if sum_sq is None:
+            sum_sq, max_abs, min_abs, mean_sum = sq, abs_max, abs_min, mean
+        else:
+            sum_sq = sum_sq + sq
+            max_abs = torch.maximum(max_abs, abs_max)
+            min_abs = torch.minimum(min_abs, abs_min)
+            mean_sum = mean_sum + mean
+
     stats = {
         'num_parameters': len(gradients),
-        'total_elements': sum(grad.numel() for grad in gradients.values()),
-        'l2_norm': compute_gradient_norm(gradients),
-        'max_value': max(grad.abs().max().item() for grad in gradients.values()),
-        'min_value': min(grad.abs().min().item() for grad in gradients.values()),
-        'mean_value': sum(grad.mean().item() for grad in gradients.values()) / len(gradients),
+        'total_elements': total_elements,
+        'l2_norm': sum_sq.sqrt().item(),
+        'max_value': max_abs.item(),
+        'min_value': min_abs.item(),
+        'mean_value': mean_sum.item() / len(gradients),
     }
 
     return stats